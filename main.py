@@ -1,10 +1,23 @@
 # pylint: disable=relative-beyond-top-level,
 import networkx as nx
-import matplotlib.pyplot as plt
-import random
 import numpy as np
 from typing import TypedDict, Optional
-from network_generator import watts_strogatz_clique_graph
+from numba import njit, prange
+from utils import generate_distribution_from_hist
+from network_generator import (
+    CONNECTION_TYPES,
+    INTER,
+    csr_to_graph,
+    edges_to_csr,
+    watts_strogatz_clique_csr,
+    watts_strogatz_edges,
+)
+
+SUSCEPTIBLE, INFECTED, RECOVERED = 0, 1, 2
+STATUS_CODES = {"susceptible": SUSCEPTIBLE, "infected": INFECTED, "recovered": RECOVERED}
+STATUS_LABELS = ("Susceptibles", "Infected", "Recovered")
+# Blue, red and green as RGBA rows, so frames can index them by status
+STATUS_COLORS = np.array([[0.0, 0.0, 1.0, 1.0], [1.0, 0.0, 0.0, 1.0], [0.0, 0.5, 0.0, 1.0]])
 
 
 r = TypedDict(
@@ -43,12 +56,80 @@ NpiParameters = TypedDict(
 )
 
 
+@njit("int64(int32[::1], int32[::1], int8[::1], int32[::1], boolean[::1], int32[::1])", cache=True)
+def _find_exposed(indptr, indices, status, infected, exposed, candidates):
+    number_exposed = 0
+    for person in infected:
+        for contact in indices[indptr[person] : indptr[person + 1]]:
+            if status[contact] == SUSCEPTIBLE and not exposed[contact]:
+                exposed[contact] = True
+                candidates[number_exposed] = contact
+                number_exposed += 1
+    return number_exposed
+
+
+# Each exposed person rolls once against the chance that at least one of
+# their infected contacts transmits. Infections are applied after the
+# parallel loop so people infected today only start spreading tomorrow.
+@njit(
+    "int64(int32[::1], int32[::1], int8[::1], int16[::1], float32[::1], int32[::1], float32[::1],"
+    " boolean[::1], int32[::1])",
+    cache=True,
+    fastmath=True,
+    parallel=True,
+)
+def _infect_exposed(
+    indptr,
+    indices,
+    status,
+    days,
+    escape_probabilities,
+    candidates,
+    uniforms,
+    exposed,
+    newly_infected,
+):
+    for i in prange(candidates.size):
+        person = candidates[i]
+        escape = np.float32(1.0)
+        for slot in range(indptr[person], indptr[person + 1]):
+            if status[indices[slot]] == INFECTED:
+                escape *= escape_probabilities[slot]
+        exposed[person] = uniforms[i] < 1 - escape
+
+    new_cases = 0
+    for person in candidates:
+        if exposed[person]:
+            exposed[person] = False
+            status[person] = INFECTED
+            days[person] = 1
+            newly_infected[new_cases] = person
+            new_cases += 1
+    return new_cases
+
+
+# Recovered people are dropped by compacting infected in place; the
+# return value is how many people are still infected.
+@njit("int64(int32[::1], int8[::1], int16[::1], float64)", cache=True)
+def _progress_disease(infected, status, days, d):
+    still_infected = 0
+    for person in infected:
+        if days[person] >= d:
+            status[person] = RECOVERED
+            days[person] = 0
+        else:
+            days[person] += 1
+            infected[still_infected] = person
+            still_infected += 1
+    return still_infected
+
+
 class Epidemic_Network:
-    infected = {"status": "infected", "days_with_disease": 1}
-    recovered = {
-        "status": "recovered",
-    }
-    G: nx.Graph
+    indptr: np.ndarray
+    indices: np.ndarray
+    edge_type: np.ndarray
+    status: np.ndarray
+    days: np.ndarray
 
     def __init__(
         self,
@@ -63,10 +144,12 @@ class Epidemic_Network:
         self.npi_parameters = npi_parameters
 
         self.random_state = random_state
-        self.daily_cases = []
+        self.daily_cases = np.zeros(max_days, dtype=np.int32)
+        self._new_cases = 0
 
+        self._rng = np.random.default_rng()
         if random_state:
-            random.setstate(random_state)
+            self._rng.bit_generator.state = random_state
 
         if "household_distribution" not in self.parameters:
             self.generate_epidemic_network(
@@ -78,194 +161,210 @@ class Epidemic_Network:
                 self.parameters["D"],
                 self.parameters["epsilon"],
             )
+        self.__update_escape_probabilities()
 
         self.distribute_initial_infection(self.parameters["i0"])
         if save_steps:
+            import matplotlib.pyplot as plt
+
             plt.figure(figsize=(5, 5))
 
         day = 1
         while day <= max_days:
-            self.count_daily_cases()
+            self.count_daily_cases(day)
+            if self._number_infected == 0 and not save_steps:
+                # Without infected people no later day can have a case
+                break
             self.update_disease_progress()
             self.interact(day, save_steps)
             day += 1
             if self.npi_parameters and self.npi_parameters["npi_start_day"] == day:
                 self.__apply_NPI()
-        plt.close()
+        if save_steps:
+            plt.close()
 
     def generate_epidemic_network(self, n: int or list, k: int, p: float) -> nx.Graph:
-        self.G = watts_strogatz_clique_graph(n, k, p)
-        nx.set_node_attributes(self.G, values="susceptible", name="status")
+        self.__set_topology(*watts_strogatz_clique_csr(n, k, p, seed=self._rng))
+
+        number_of_nodes = self.indptr.size - 1
+        self.status = np.full(number_of_nodes, SUSCEPTIBLE, dtype=np.int8)
+        # days never exceeds d, which int16 holds for any d below 32768
+        self.days = np.zeros(number_of_nodes, dtype=np.int16)
+        self._infected = np.empty(number_of_nodes, dtype=np.int32)
+        self._number_infected = 0
+        self._exposed = np.zeros(number_of_nodes, dtype=np.bool_)
+        self._candidates = np.empty(number_of_nodes, dtype=np.int32)
+        self._uniforms = np.empty(number_of_nodes, dtype=np.float32)
+
+    @property
+    def G(self) -> nx.Graph:
+        if self._graph is None:
+            self._graph = csr_to_graph(self.indptr, self.indices, self.edge_type)
+        return self._graph
 
     def interact(self, day, save_steps=False):
         if save_steps:
             self.draw(day)
-        infected = self.get_by_status("infected")
-        infected_person_contacts = self.G.edges(infected, data=True)
-        susceptibles = (
-            (person2, connection["connection_type"])
-            for person1, person2, connection in infected_person_contacts
-            if self.G.nodes[person2]["status"] == "susceptible"
+        number_exposed = _find_exposed(
+            self.indptr,
+            self.indices,
+            self.status,
+            self._infected[: self._number_infected],
+            self._exposed,
+            self._candidates,
         )
-
-        for susceptible_person, connection_type in susceptibles:
-            if self.infection_occurred(connection_type):
-                nx.set_node_attributes(self.G, values={susceptible_person: self.infected})
+        new_cases = _infect_exposed(
+            self.indptr,
+            self.indices,
+            self.status,
+            self.days,
+            self._escape_probabilities,
+            self._candidates[:number_exposed],
+            self._rng.random(dtype=np.float32, out=self._uniforms[:number_exposed]),
+            self._exposed,
+            self._infected[self._number_infected :],
+        )
+        self._number_infected += new_cases
+        self._new_cases += new_cases
 
     def update_disease_progress(self):
-        def parse_attr(attributes):
-            if attributes["days_with_disease"] >= self.parameters["d"]:
-                attributes.pop("days_with_disease", None)
-                return self.recovered
-
-            attributes["days_with_disease"] += 1
-            return attributes
-
-        updated_infected = {
-            person: parse_attr(attributes)
-            for person, attributes in self.G.nodes(data=True)
-            if attributes["status"] == "infected"
-        }
-        nx.set_node_attributes(self.G, values=updated_infected)
-
-    def infection_occurred(self, connection_type: str) -> bool:
-        return random.choices(
-            [True, False],
-            weights=[
-                self.parameters["r"][connection_type],
-                1 - self.parameters["r"][connection_type],
-            ],
-        )[0]
+        self._number_infected = _progress_disease(
+            self._infected[: self._number_infected], self.status, self.days, self.parameters["d"]
+        )
 
     def distribute_initial_infection(self, number_of_infections: int) -> None:
-        whole_network = tuple(self.G.nodes())
-        random_infected_people = random.sample(whole_network, number_of_infections)
-        for person in random_infected_people:
-            nx.set_node_attributes(self.G, values={person: self.infected})
+        random_infected_people = self._rng.choice(
+            self.status.size, number_of_infections, replace=False
+        )
+        self._number_infected = number_of_infections
+        self._infected[:number_of_infections] = random_infected_people
+        self.status[random_infected_people] = INFECTED
+        self.days[random_infected_people] = 1
+        self._new_cases += number_of_infections
 
     def get_by_status(self, status):
-        return [
-            person
-            for person, person_status in nx.get_node_attributes(self.G, "status").items()
-            if person_status == status
-        ]
+        return np.flatnonzero(self.status == STATUS_CODES[status])
 
-    def count_daily_cases(self):
-        infected_people = nx.get_node_attributes(self.G, "days_with_disease")
-        number_of_days_with_infection = list(infected_people.values())
-        self.daily_cases.append(number_of_days_with_infection.count(1))
+    def count_daily_cases(self, day):
+        self.daily_cases[day - 1] = self._new_cases
+        self._new_cases = 0
 
     def draw(self, day):
-        plt.title(f"Day: {day}")
+        import matplotlib.pyplot as plt
+        from matplotlib.collections import LineCollection
+
         nodesize = 40
 
-        infected = self.get_by_status("infected")
-        susceptibles = self.get_by_status("susceptible")
-        recovered = self.get_by_status("recovered")
-
-        pos = nx.spring_layout(self.G, seed=10)
-        nx.draw_networkx_nodes(
-            self.G,
-            pos=pos,
-            nodelist=susceptibles,
-            node_color="blue",
-            label="Susceptibles",
-            node_size=nodesize,
-        )  # , node_size=50,
-
-        nx.draw_networkx_nodes(
-            self.G,
-            pos=pos,
-            nodelist=infected,
-            node_color="red",
-            label="Infected",
-            node_size=nodesize,
-        )
+        # Artists are built once per topology; later days only recolour the nodes
+        if self._pos is None:
+            layout = nx.spring_layout(self.G, seed=10)
+            self._pos = np.array([layout[person] for person in range(self.status.size)])
+            people = np.repeat(np.arange(self.status.size), np.diff(self.indptr))
+            edges = people < self.indices
+            edge_segments = np.stack(
+                [self._pos[people[edges]], self._pos[self.indices[edges]]], axis=1
+            )
 
-        nx.draw_networkx_nodes(
-            self.G,
-            pos=pos,
-            nodelist=recovered,
-            node_color="green",
-            label="Recovered",
-            node_size=nodesize,
-        )
+            plt.clf()
+            plt.gca().add_collection(LineCollection(edge_segments, colors="gray", zorder=1))
+            self._node_markers = plt.scatter(self._pos[:, 0], self._pos[:, 1], s=nodesize, zorder=2)
+            for label, color in zip(STATUS_LABELS, STATUS_COLORS):
+                plt.scatter([], [], color=color, label=label, s=nodesize)
+
+            plt.tick_params(left=False, bottom=False, labelleft=False, labelbottom=False)
+            plt.legend(scatterpoints=1)
 
-        nx.draw_networkx_edges(self.G, pos=pos, edge_color="gray")
-        plt.legend(scatterpoints=1)
+        self._node_markers.set_facecolor(STATUS_COLORS[self.status])
+        plt.title(f"Day: {day}")
         plt.savefig(f"{day}-evolution.png")
-        plt.clf()
 
-        return pos
+        return self._pos
 
     def get_daily_cases(self):
         return self.daily_cases
 
     def __make_structural_changes(self):
-        H = nx.watts_strogatz_graph(
-            self.G.number_of_nodes(), self.parameters["D"], self.parameters["epsilon"]
+        number_of_nodes = self.status.size
+        source, target = watts_strogatz_edges(
+            number_of_nodes, self.parameters["D"], self.parameters["epsilon"], self._rng
         )
+        edge_type = np.full(source.size, INTER, dtype=np.int8)
 
-        new_edges = H.edges()
-        old_edges = self.G.edges()
-        self.G.remove_edges_from(old_edges)
-        self.G.add_edges_from(new_edges)
+        self.__set_topology(*edges_to_csr(number_of_nodes, source, target, edge_type))
+
+    def __set_topology(self, indptr, indices, edge_type):
+        self.indptr, self.indices, self.edge_type = indptr, indices, edge_type
+        self._graph = None
+        self._pos = None
+
+    def __update_escape_probabilities(self):
+        escape_probabilities = np.array(
+            [1 - self.parameters["r"][c] for c in CONNECTION_TYPES], dtype=np.float32
+        )
+        self._escape_probabilities = escape_probabilities[self.edge_type]
 
     def __apply_NPI(self):
         self.parameters = {**self.parameters, **self.npi_parameters}
         if any(k in self.npi_parameters for k in ("D", "epsilon")):
             self.__make_structural_changes()
+        self.__update_escape_probabilities()
 
     def get_random_state(self):
-        return random.getstate()
+        return self._rng.bit_generator.state
 
 
-if __name__ == "__main__":
-    from utils import generate_distribution_from_hist
-
-    def plot(D, epsilon, r_intra, r_inter, d, i0, hist=np.array([]), n=None):
-
-        parameters = {
-            "D": D,
-            "epsilon": epsilon,
-            "r": {"intra": r_intra, "inter": r_inter},
-            "d": d,
-            "i0": i0,
-        }
-
-        if n:
-            parameters["n"] = n
-            sulfix = f"n={n}_k={D}_epsilon={epsilon}_r={r_inter}_d={d}_i0={i0}"
-        if hist.size > 0:
-            dist = generate_distribution_from_hist(hist)
-            parameters["household_distribution"] = dist
-            sulfix = (
-                f"n={sum(dist)}_k={D}_epsilon={epsilon}"
-                f"_r_inter={r_inter}_r_intra={r_intra}_d={d}_i0={i0}"
-            )
+def plot(D, epsilon, r_intra, r_inter, d, i0, hist=np.array([]), n=None, seed=None):
+    import matplotlib.pyplot as plt
 
-        network = Epidemic_Network(
-            parameters=parameters,
-            max_days=100
-            # npi_parameters={"npi_start_day": 20, "D": 2, "epsilon": 0, "r": 0, "d": 6},
+    rng = np.random.default_rng(seed)
+    parameters = {
+        "D": D,
+        "epsilon": epsilon,
+        "r": {"intra": r_intra, "inter": r_inter},
+        "d": d,
+        "i0": i0,
+    }
+
+    if n:
+        parameters["n"] = n
+        sulfix = f"n={n}_k={D}_epsilon={epsilon}_r={r_inter}_d={d}_i0={i0}"
+    if hist.size > 0:
+        dist = generate_distribution_from_hist(hist, seed=rng)
+        parameters["household_distribution"] = dist
+        sulfix = (
+            f"n={sum(dist)}_k={D}_epsilon={epsilon}"
+            f"_r_inter={r_inter}_r_intra={r_intra}_d={d}_i0={i0}"
         )
 
-        _, (ax1, ax2) = plt.subplots(nrows=2, ncols=1, sharex=True, dpi=300)
-        ax1.set_ylabel("Cumulative cases")
-        ax2.set_ylabel("Daily cases")
-        ax2.set_xlabel("Days")
+    network = Epidemic_Network(
+        parameters=parameters,
+        max_days=100,
+        random_state=rng.bit_generator.state,
+        # npi_parameters={"npi_start_day": 20, "D": 2, "epsilon": 0, "r": 0, "d": 6},
+    )
+
+    _, (ax1, ax2) = plt.subplots(nrows=2, ncols=1, sharex=True, dpi=300)
+    ax1.set_ylabel("Cumulative cases")
+    ax2.set_ylabel("Daily cases")
+    ax2.set_xlabel("Days")
 
-        daily_cases = network.get_daily_cases()
-        cumulative_cases = np.cumsum(daily_cases)
+    daily_cases = network.get_daily_cases()
+    cumulative_cases = np.cumsum(daily_cases)
 
-        ax1.plot(cumulative_cases, color="black", label="Network")
-        ax2.bar(list(range(len(daily_cases))), daily_cases, color="red", edgecolor="black")
+    ax1.plot(cumulative_cases, color="black", label="Network")
+    ax2.bar(list(range(len(daily_cases))), daily_cases, color="red", edgecolor="black")
 
-        ax1.legend()
+    ax1.legend()
 
-        filename = f"cases_vs_days_{sulfix}.png"
-        plt.savefig(filename)
-        plt.close()
+    filename = f"cases_vs_days_{sulfix}.png"
+    plt.savefig(filename)
+    plt.close()
+
+
+if __name__ == "__main__":
+    import matplotlib
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
 
     hist = np.array(
         [
@@ -288,4 +387,19 @@ if __name__ == "__main__":
 
     # hist = np.array([[5, 20]])
 
-    plot(hist=hist, D=6, epsilon=0.3, r_intra=0.5, r_inter=0.1, d=6, i0=100)
+    # Append further scenarios here to run them in parallel
+    sweep = [dict(hist=hist, D=6, epsilon=0.3, r_intra=0.5, r_inter=0.1, d=6, i0=100)]
+    seeds = np.random.SeedSequence().spawn(len(sweep))
+
+    # Importing main already starts numba's threading layer, which does not survive a fork.
+    # Workers only write PNGs, so they never need an interactive backend.
+    with ProcessPoolExecutor(
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=matplotlib.use,
+        initargs=("Agg",),
+    ) as executor:
+        runs = [
+            executor.submit(plot, **scenario, seed=seed) for scenario, seed in zip(sweep, seeds)
+        ]
+        for run in runs:
+            run.result()
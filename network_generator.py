@@ -1,43 +1,118 @@
 import networkx as nx
 import numpy as np
 
+CONNECTION_TYPES = ("intra", "inter")
+INTRA, INTER = 0, 1
 
-def __create_edges(current_node, new_nodes):
-    node_list = np.array([current_node, *new_nodes])
-    edges = [(node, neighbor) for node in node_list for neighbor in node_list[node_list != node]]
-    return edges
+__MAX_REWIRING_ATTEMPTS = 100
 
 
-def __add_cliques_to_network(graph, distribution):
-    G = graph.copy()
-    graph_len = len(G)
-    new_node_list = np.arange(graph_len, sum(distribution))
+def __create_household_edges(distribution, first_new_node):
+    sizes = np.asarray(distribution)
+    extra_members = np.maximum(sizes - 1, 0)
+    first_extra_member = first_new_node + np.cumsum(extra_members) - extra_members
 
-    G.add_nodes_from(new_node_list)
+    source, target = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+    for size in np.unique(sizes[sizes > 1]):
+        households = np.flatnonzero(sizes == size)
+        members = np.column_stack(
+            [households, first_extra_member[households, None] + np.arange(size - 1)]
+        )
+        first, second = np.triu_indices(size, k=1)
+        source.append(members[:, first].ravel())
+        target.append(members[:, second].ravel())
 
-    a = 0
-    for i in range(len(distribution)):
-        if distribution[i] == 1:
-            continue
+    return np.concatenate(source), np.concatenate(target)
 
-        house_nodes = new_node_list[a : a + distribution[i] - 1]
-        edges = __create_edges(i, house_nodes)
-        G.add_edges_from(edges, connection_type="intra")
-        a += distribution[i] - 1
 
-    return G
-
-
-def watts_strogatz_clique_graph(distribution, k, p):
+def watts_strogatz_clique_csr(distribution, k, p, seed=None):
+    rng = np.random.default_rng(seed)
     try:
         n = len(distribution)
-        G = nx.watts_strogatz_graph(n, k, p)
-        nx.set_edge_attributes(G, values="inter", name="connection_type")
-        G = __add_cliques_to_network(graph=G, distribution=distribution)
+        number_of_nodes = sum(distribution)
     except TypeError:
-        n = distribution
-        G = nx.watts_strogatz_graph(n, k, p)
-        nx.set_edge_attributes(G, values="inter", name="connection_type")
+        n = number_of_nodes = distribution
+
+    source, target = watts_strogatz_edges(n, k, p, rng)
+    edge_type = np.full(source.size, INTER, dtype=np.int8)
+    if number_of_nodes > n:
+        household_source, household_target = __create_household_edges(
+            distribution, first_new_node=n
+        )
+        source = np.concatenate([source, household_source])
+        target = np.concatenate([target, household_target])
+        edge_type = np.concatenate([edge_type, np.full(household_source.size, INTRA, np.int8)])
+
+    return edges_to_csr(number_of_nodes, source, target, edge_type)
+
+
+def watts_strogatz_clique_graph(distribution, k, p, seed=None):
+    return csr_to_graph(*watts_strogatz_clique_csr(distribution, k, p, seed))
+
+
+def watts_strogatz_edges(n, k, p, rng):
+    if k > n:
+        raise nx.NetworkXError("k>n, choose smaller k or larger n")
+    if k == n:
+        source, target = np.triu_indices(n, k=1)
+        return source.astype(np.int32), target.astype(np.int32)
+
+    nodes = np.arange(n, dtype=np.int32)
+    source = np.tile(nodes, k // 2)
+    lattice_target = (source + np.repeat(np.arange(1, k // 2 + 1, dtype=np.int32), n)) % n
+    target = lattice_target.copy()
+
+    # A lattice where every node already touches all the others has nothing to rewire to
+    rewired = (rng.random(source.size) < p) & (2 * (k // 2) < n - 1)
+    invalid = rewired
+    attempts = 0
+    while invalid.any():
+        # Give up on edges whose source ran out of free targets and keep them in the lattice
+        if attempts == __MAX_REWIRING_ATTEMPTS:
+            target[invalid] = lattice_target[invalid]
+            rewired = rewired & ~invalid
+            attempts = 0
+        else:
+            target[invalid] = rng.integers(0, n, size=invalid.sum(), dtype=np.int32)
+            attempts += 1
+
+        # Lattice edges sort first, so a duplicate is always blamed on a rewired edge
+        order = np.argsort(rewired, kind="stable")
+        keys = np.minimum(source, target).astype(np.int64) * n + np.maximum(source, target)
+        _, first_occurrences = np.unique(keys[order], return_index=True)
+        duplicated = np.ones(source.size, dtype=bool)
+        duplicated[order[first_occurrences]] = False
+
+        invalid = rewired & ((source == target) | duplicated)
+
+    return source, target
+
+
+def edges_to_csr(number_of_nodes, source, target, edge_type):
+    nodes = np.concatenate([source, target])
+    neighbors = np.concatenate([target, source])
+    connection_types = np.concatenate([edge_type, edge_type])
+    order = np.argsort(nodes, kind="stable")
+
+    indptr = np.zeros(number_of_nodes + 1, dtype=np.int32)
+    indptr[1:] = np.cumsum(np.bincount(nodes, minlength=number_of_nodes))
+    indices = neighbors[order].astype(np.int32)
+    edge_type = connection_types[order].astype(np.int8)
+
+    return indptr, indices, edge_type
+
+
+def csr_to_graph(indptr, indices, edge_type):
+    number_of_nodes = indptr.size - 1
+    nodes = np.repeat(np.arange(number_of_nodes), np.diff(indptr))
+
+    G = nx.Graph()
+    G.add_nodes_from(range(number_of_nodes))
+    for code, connection_type in enumerate(CONNECTION_TYPES):
+        edges = (edge_type == code) & (nodes < indices)
+        G.add_edges_from(
+            zip(nodes[edges].tolist(), indices[edges].tolist()), connection_type=connection_type
+        )
     return G
 
 
@@ -0,0 +1,34 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from main import Epidemic_Network
+from network_generator import watts_strogatz_clique_csr, watts_strogatz_edges
+
+
+@pytest.mark.parametrize(
+    "n, k, p", [(7, 6, 0.1), (10, 8, 0.9), (6, 6, 0.2), (6, 6, 0), (20, 16, 0.3), (12, 8, 1.0)]
+)
+def test_dense_watts_strogatz_edges_are_simple(n, k, p):
+    for seed in range(10):
+        source, target = watts_strogatz_edges(n, k, p, np.random.default_rng(seed))
+        edges = {(min(u, v), max(u, v)) for u, v in zip(source.tolist(), target.tolist())}
+
+        assert (source != target).all()
+        assert len(edges) == source.size == (n * (n - 1) // 2 if k == n else n * (k // 2))
+
+
+def test_k_larger_than_n_raises():
+    with pytest.raises(nx.NetworkXError):
+        watts_strogatz_clique_csr([1, 2, 3], k=4, p=0.1, seed=0)
+
+
+def test_dense_epidemic_network_is_built():
+    parameters = {"n": 7, "D": 6, "epsilon": 0.1, "r": {"intra": 0.3, "inter": 0.1}, "d": 6}
+    parameters.update({"i0": 1, "household_distribution": [1, 2, 1, 3, 1, 2, 1]})
+
+    network = Epidemic_Network(
+        parameters, max_days=10, random_state=np.random.default_rng(0).bit_generator.state
+    )
+
+    assert network.indptr.size == sum(parameters["household_distribution"]) + 1
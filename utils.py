@@ -1,9 +1,7 @@
-import random
+import numpy as np
 
 
-def generate_distribution_from_hist(data):
-    dist = []
-    for number, occurrencies in data:
-        dist += [number] * occurrencies
-    random.shuffle(dist)
-    return dist
+def generate_distribution_from_hist(data, seed=None):
+    numbers, occurrencies = np.asarray(data).T
+    dist = np.repeat(numbers, occurrencies)
+    return np.random.default_rng(seed).permutation(dist).tolist()